@@ -0,0 +1,37 @@
+# Generated from controls.g4 by ANTLR 4.7.2
+from antlr4 import *
+if __name__ is not None and "." in __name__:
+    from .controlsParser import controlsParser
+else:
+    from controlsParser import controlsParser
+
+# This class defines a complete listener for a parse tree produced by controlsParser.
+class controlsListener(ParseTreeListener):
+
+    # Enter a parse tree produced by controlsParser#nodeControl.
+    def enterNodeControl(self, ctx:controlsParser.NodeControlContext):
+        pass
+
+    # Exit a parse tree produced by controlsParser#nodeControl.
+    def exitNodeControl(self, ctx:controlsParser.NodeControlContext):
+        pass
+
+
+    # Enter a parse tree produced by controlsParser#timeControl.
+    def enterTimeControl(self, ctx:controlsParser.TimeControlContext):
+        pass
+
+    # Exit a parse tree produced by controlsParser#timeControl.
+    def exitTimeControl(self, ctx:controlsParser.TimeControlContext):
+        pass
+
+
+    # Enter a parse tree produced by controlsParser#controls.
+    def enterControls(self, ctx:controlsParser.ControlsContext):
+        pass
+
+    # Exit a parse tree produced by controlsParser#controls.
+    def exitControls(self, ctx:controlsParser.ControlsContext):
+        pass
+
+
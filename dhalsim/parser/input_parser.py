@@ -1,4 +1,11 @@
+import hashlib
+import json
+import os
+import stat
 import sys
+import tempfile
+from itertools import chain
+from pathlib import Path
 
 import pandas as pd
 import wntr
@@ -7,9 +14,13 @@ from antlr4 import *
 from ..epynet import epynetUtils
 from ..epynet.network import WaterDistributionNetwork
 from dhalsim.parser.antlr.controlsLexer import controlsLexer
+from dhalsim.parser.antlr.controlsListener import controlsListener
 from dhalsim.parser.antlr.controlsParser import controlsParser
 from dhalsim.py3_logger import get_logger
 
+# Version of the controls cache, bump it when the parsed controls change so old caches are not used
+CONTROLS_CACHE_VERSION = 1
+
 class Error(Exception):
     """Base class for exceptions in this module."""
 
@@ -35,6 +46,56 @@ def value_to_status(actuator_value):
         return "open"
 
 
+def state_to_action(state):
+    """
+    Translates the state of a control to the action of an actuator.
+
+    :param state: The STATE token of the control, OPEN, CLOSED or a pump speed
+    :type state: str
+    """
+    if state == 'OPEN' or state == 'CLOSED':
+        return state.lower()
+    else:
+        return float(state)
+
+
+class ControlsCollector(controlsListener):
+    """
+    Listener collecting the controls of the [CONTROLS] section while the parse tree is walked.
+    """
+
+    def __init__(self):
+        """Constructor method"""
+        self.controls = []
+
+    def enterNodeControl(self, ctx):
+        """
+        Collects an AT NODE control.
+
+        :param ctx: the nodeControl context
+        """
+        self.controls.append({
+            "type": ctx.CONDITION().getText().lower(),
+            "dependant": ctx.ID(1).getText(),
+            "value": float(ctx.STATE(1).getText()),
+            "actuator": ctx.ID(0).getText(),
+            "action": state_to_action(ctx.STATE(0).getText())
+        })
+
+    def enterTimeControl(self, ctx):
+        """
+        Collects a TIME control.
+
+        :param ctx: the timeControl context
+        """
+        self.controls.append({
+            "type": "time",
+            "value": int(float(ctx.STATE(1).getText())),
+            "actuator": ctx.ID().getText(),
+            "action": state_to_action(ctx.STATE(0).getText()),
+        })
+
+
 class InputParser:
     """
     Class handling the parsing of .inp input files.
@@ -60,6 +121,9 @@ class InputParser:
             self.inp_file_path = self.data['inp_file']
         else:
             raise NoInpFileGiven()
+        # Keep the inp file in memory, the controls and tanks sections are parsed from it
+        with open(self.inp_file_path) as inp_file:
+            self.inp_file_contents = inp_file.read()
         # Read the inp file with WNTR
         self.simulator = self.data["simulator"]
 
@@ -110,52 +174,77 @@ class InputParser:
         Generates list of controls with their types, values, actuators, and
         potentially dependant; then adds that to self.data to be written to the yaml.
         """
-        input_file = FileStream(self.inp_file_path)
+        controls = self.load_controls()
+
+        # Map every actuator to the plcs controlling it, so each control is assigned with one lookup
+        actuator_plcs = {}
+        for plc in self.data['plcs']:
+            plc['controls'] = []
+            for actuator in plc['actuators']:
+                actuator_plcs.setdefault(actuator, []).append(plc)
+
+        for control in controls:
+            for plc in actuator_plcs.get(control['actuator'], []):
+                plc['controls'].append(control)
+
+    def parse_controls(self):
+        """
+        Parses the [CONTROLS] section of the inp file with ANTLR.
+
+        :return: list of control dicts
+        """
+        input_file = InputStream(self.inp_file_contents)
         tree = controlsParser(CommonTokenStream(controlsLexer(input_file))).controls()
-        #self.logger.debug('Controls tree')
-        controls = []
-        for i in range(0, tree.getChildCount()):
-            child = tree.getChild(i)
-            # Get all common control values from the control
-            actuator = str(child.getChild(2))
-            action = str(child.getChild(4))
-
-            if action == 'OPEN' or action == 'CLOSED':
-                action_aux = action.lower()
-            else:
-                action_aux = float(action)
-
-            if str(child.getChild(8)) == 'NODE':
-                # This is an AT NODE control
-                dependant = str(child.getChild(10))
-                value = float(str(child.getChild(14)))
-                
-                controls.append({
-                    "type": str(child.getChild(12)).lower(),
-                    "dependant": dependant,
-                    "value": value,
-                    "actuator": actuator,
-                    "action": action_aux
-                })
+        listener = ControlsCollector()
+        ParseTreeWalker.DEFAULT.walk(listener, tree)
+        return listener.controls
 
-                #self.logger.debug('control:\n' + str(controls[-1]))
+    def controls_cache_path(self):
+        """
+        Gets the path of the controls cache of the inp file, keyed by the sha1 of its contents.
+        The cache directory must only be accessible by the current user, so no other user can
+        plant controls in it.
 
-            if str(child.getChild(8)) == 'TIME':
-                # This is a TIME control
-                value = float(str(child.getChild(10)))
-                controls.append({
-                    "type": "time",
-                    "value": int(value),
-                    "actuator": actuator,
-                    "action": action_aux,
-                })
+        :raise OSError: when the cache directory cannot be created or is not private
+        """
+        cache_dir = Path(tempfile.gettempdir()) / f"dhalsim-{os.getuid()}"
+        cache_dir.mkdir(mode=0o700, exist_ok=True)
+        cache_stat = cache_dir.lstat()
+        if not stat.S_ISDIR(cache_stat.st_mode) or cache_stat.st_uid != os.getuid() \
+                or stat.S_IMODE(cache_stat.st_mode) & 0o077:
+            raise OSError(f"{cache_dir} is not a private directory")
 
-        for plc in self.data['plcs']:
-            plc['controls'] = []
-            actuators = plc['actuators']
-            for control in controls:
-                if control['actuator'] in actuators:
-                    plc['controls'].append(control)
+        digest = hashlib.sha1(self.inp_file_contents.encode()).hexdigest()
+        return cache_dir / f"controls_v{CONTROLS_CACHE_VERSION}_{digest}.json"
+
+    def load_controls(self):
+        """
+        Gets the controls of the inp file. Parsed controls are cached in a private directory in
+        the temporary directory, so in batch mode an unchanged inp file is only parsed once.
+
+        :return: list of control dicts
+        """
+        try:
+            cache_path = self.controls_cache_path()
+        except OSError as exc:
+            self.logger.warning(f"Not caching the controls of {self.inp_file_path}: {exc}")
+            return self.parse_controls()
+
+        try:
+            with cache_path.open(mode='r') as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            pass
+
+        controls = self.parse_controls()
+        try:
+            # Write to a temporary file first, so other simulations never read a partial cache
+            with tempfile.NamedTemporaryFile(mode='w', dir=cache_path.parent, delete=False) as cache_file:
+                json.dump(controls, cache_file)
+            os.replace(cache_file.name, cache_path)
+        except OSError as exc:
+            self.logger.debug(f"Could not cache the controls of {self.inp_file_path}: {exc}")
+        return controls
 
     def generate_times(self):
         """
@@ -180,51 +269,37 @@ class InputParser:
         Generates list of actuators with their initial states
         and adds to the data to be written to the yaml file.
         """
+        actuators = []
 
-        pumps = []
-        valves = []
-
+        # Pumps first, then valves, in a single list
         if self.simulator == 'epynet':
-            for pump in self.wn.pumps:
-                pumps.append({
-                    'name': pump.uid,
-                    'initial_state': 'open' if pump.initstatus else 'closed'
-                })
-            for valve in self.wn.valves:
-                valves.append({
-                    'name': valve.uid,
-                    'initial_state': 'open' if valve.initstatus else 'closed'
+            for actuator in chain(self.wn.pumps, self.wn.valves):
+                actuators.append({
+                    'name': actuator.uid,
+                    'initial_state': 'open' if actuator.initstatus else 'closed'
                 })
         else:
-            for pump in self.wn.pumps():
-                pumps.append({
-                    "name": pump[0],
-                    "initial_state": value_to_status(pump[1].status.value)
-                })
-            for valve in self.wn.valves():
-                valves.append({
-                    "name": valve[0],
-                    "initial_state": value_to_status(valve[1].status.value)
+            for name, link in chain(self.wn.pumps(), self.wn.valves()):
+                actuators.append({
+                    "name": name,
+                    "initial_state": value_to_status(link.status.value)
                 })
-        # Append valves to pumps
-        pumps.extend(valves)
-        self.data['actuators'] = pumps
+        self.data['actuators'] = actuators
 
     def read_initial_tank_values_from_inp(self):
         """ Reads the tank values from the EPANET inp file"""
         show = False
         tank_tuples = []
-        with open(self.inp_file_path) as infile:
-            for line in infile:
-                if show and line.startswith('['):
-                    show = False
-                if show == True:
-                    split_line = line.split()
-                    if len(split_line) > 1:
-                        tank_tuples.append((split_line[0], split_line[2]))
-                if line.startswith('[TANKS]'):
-                    show = True
-                    continue
+        for line in self.inp_file_contents.splitlines():
+            if show and line.startswith('['):
+                show = False
+            if show == True:
+                split_line = line.split()
+                if len(split_line) > 1:
+                    tank_tuples.append((split_line[0], split_line[2]))
+            if line.startswith('[TANKS]'):
+                show = True
+                continue
         del tank_tuples[0]
         self.data['initial_tank_values'] = dict(tank_tuples)
 
@@ -232,15 +307,11 @@ class InputParser:
         """Generates all tanks with their initial values if the user configured them in the yaml file"""
 
         initial_values = {}
-        initial_tank_levels = pd.read_csv(self.data['initial_tank_data'])
-        self.verify_csv_input(initial_tank_levels, 'initial_tank_data')
+        initial_tank_levels = self.read_csv_row('initial_tank_data', float)
         # For all columns in csv
-        for index in range(len(initial_tank_levels.columns)):
-            name = initial_tank_levels.columns[index]
+        for name, value in initial_tank_levels.items():
             # Insert tank value into data
-            data_index = self.data["batch_index"] if self.batch_mode else 0
-            initial_values[str(name)] = \
-                float(initial_tank_levels.iloc[data_index, index])
+            initial_values[str(name)] = float(value)
 
         self.data['initial_tank_values'] = initial_values
 
@@ -248,15 +319,11 @@ class InputParser:
         """Generates list of routers with their network losses from the input csv"""
 
         network_loss = {}
-        network_loss_data = pd.read_csv(self.data['network_loss_data'])
-        self.verify_csv_input(network_loss_data, 'network_loss_data')
+        network_loss_data = self.read_csv_row('network_loss_data', float)
         # For all columns in csv
-        for index in range(len(network_loss_data.columns)):
-            name = network_loss_data.columns[index]
+        for name, value in network_loss_data.items():
             # Insert loss  value into data
-            data_index = self.data["batch_index"] if self.batch_mode else 0
-            network_loss[str(name)] = \
-                float(network_loss_data.iloc[data_index, index])
+            network_loss[str(name)] = float(value)
 
         self.data['network_loss_values'] = network_loss
 
@@ -264,18 +331,34 @@ class InputParser:
         """Generates list of routers with their network delays from the input csv"""
 
         network_delay = {}
-        network_delay_data = pd.read_csv(self.data['network_delay_data'])
-        self.verify_csv_input(network_delay_data, 'network_delay_data')
+        network_delay_data = self.read_csv_row('network_delay_data', float)
         # For all columns in csv
-        for index in range(len(network_delay_data.columns)):
-            name = network_delay_data.columns[index]
+        for name, value in network_delay_data.items():
+            # Integral delays are written without a fraction, as pandas does for a column of integers
+            if value.is_integer():
+                value = int(value)
             # Insert tank : value into data
-            data_index = self.data["batch_index"] if self.batch_mode else 0
-            network_delay[str(name)] = \
-                str(network_delay_data.iloc[data_index, index]) + "ms"
+            network_delay[str(name)] = str(value) + "ms"
 
         self.data['network_delay_values'] = network_delay
 
+    def read_csv_row(self, data, dtype):
+        """
+        Reads the row of a csv file that belongs to this simulation. Only the rows needed to
+        verify the csv against the number of batch simulations are read from the file.
+
+        :param data: name of the data in the intermediate yaml that holds the csv path
+        :param dtype: type of the values, given explicitly because pandas would infer the type
+            of a column from the rows that were read only
+        :return: dict with the column names and values of this simulation
+        """
+        rows = self.data['batch_simulations'] if self.batch_mode else 1
+        dataframe = pd.read_csv(self.data[data], nrows=rows, dtype=dtype)
+        self.verify_csv_input(dataframe, data)
+
+        data_index = self.data["batch_index"] if self.batch_mode else 0
+        return {name: dataframe[name].iloc[data_index] for name in dataframe.columns}
+
     def verify_csv_input(self, dataframe, data):
         """
         Verifies the csv files have the proper number of rows for a simulation
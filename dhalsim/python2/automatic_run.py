@@ -14,6 +14,7 @@ from mininet.net import Mininet
 from mininet.cli import CLI
 from mininet.link import TCLink
 
+from intermediate_loader import dump_intermediate_pickle
 from topo.simple_topo import SimpleTopo
 from topo.complex_topo import ComplexTopo
 
@@ -69,6 +70,9 @@ class GeneralCPS(MiniCPS):
         with self.intermediate_yaml.open(mode='r') as file:
             self.data = yaml.safe_load(file)
 
+        # The yaml is final now, the plc and scada processes load this parsed copy
+        dump_intermediate_pickle(self.data, self.intermediate_yaml)
+
         if self.data["mininet_cli"]:
             CLI(self.net)
 
@@ -45,6 +45,19 @@ class BasePLC(PLC):
         self.noise_scale = noise_scale
         self.week_index = week_index
 
+    def back_off_receive(self, plc_ip, period, max_backoff):
+        """
+        Registers a failed receive from the PLC at plc_ip, which is not polled again until its backoff passed.
+        The backoff is one period after the first consecutive failure and doubles after every next one,
+        up to max_backoff.
+        :return: the backoff in seconds
+        """
+        failures = self.receive_failures.get(plc_ip, 0) + 1
+        self.receive_failures[plc_ip] = failures
+        backoff = min(max_backoff, period * 2 ** (failures - 1))
+        self.receive_retry_time[plc_ip] = time.time() + backoff
+        return backoff
+
     def sigint_handler(self, sig, frame):
         self.logger.debug('PLC shutdown commencing.')
         self.reader = False
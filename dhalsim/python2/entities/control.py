@@ -1,4 +1,5 @@
 from abc import ABCMeta, abstractmethod
+from decimal import Decimal
 
 class Control:
     """Defines a control for a PLC to enforce
@@ -35,6 +36,8 @@ class BelowControl(Control):
     def __init__(self, actuator, action, dependant, value):
         super(BelowControl, self).__init__(actuator, action, value)
         self.dependant = dependant
+        # Tag values are Decimals, comparing them to a Decimal avoids converting the value every check
+        self.threshold = Decimal(value)
 
     def apply(self, generic_plc):
         """Applies the BELOW control rule using a given PLC
@@ -42,7 +45,7 @@ class BelowControl(Control):
         :param generic_plc: the PLC that will apply the control actions
         """
         dep_val = generic_plc.get_tag(self.dependant)
-        if dep_val < self.value:
+        if dep_val < self.threshold:
             generic_plc.set_tag(self.actuator, self.action)
             generic_plc.logger.debug(
                 generic_plc.intermediate_plc["name"] + " applied " + str(self) +
@@ -63,6 +66,8 @@ class AboveControl(Control):
     def __init__(self, actuator, action, dependant, value):
         super(AboveControl, self).__init__(actuator, action, value)
         self.dependant = dependant
+        # Tag values are Decimals, comparing them to a Decimal avoids converting the value every check
+        self.threshold = Decimal(value)
 
     def apply(self, generic_plc):
         """
@@ -71,7 +76,7 @@ class AboveControl(Control):
         :param generic_plc: the PLC that will apply the control actions
         """
         dep_val = generic_plc.get_tag(self.dependant)
-        if dep_val > self.value:
+        if dep_val > self.threshold:
             generic_plc.set_tag(self.actuator, self.action)
             generic_plc.logger.debug(
                 generic_plc.intermediate_plc["name"] + " applied " + str(self) + " because dep_val " + str(dep_val))
@@ -7,17 +7,20 @@ from decimal import Decimal
 from pathlib import Path
 import random
 
-import yaml
-
 from basePLC import BasePLC
 from entities.attack import TimeAttack, TriggerBelowAttack, TriggerAboveAttack, TriggerBetweenAttack
 from entities.control import AboveControl, BelowControl, TimeControl
+from intermediate_loader import load_intermediate_yaml
 from py2_logger import get_logger
 
 import threading
 import thread
 
 
+# Values written to the database for the status of an actuator
+ACTUATOR_STATUS = {'closed': 0, 'open': 1}
+
+
 class Error(Exception):
     """Base class for exceptions in this module."""
 
@@ -49,11 +52,13 @@ class GenericPLC(BasePLC):
     PLC_CACHE_UPDATE_TIME = 0.05
     """ Time in seconds the SCADA server updates its cache"""
 
+    RECEIVE_BACKOFF_MAX = 2
+    """Maximum time in seconds the PLC waits before receiving from an unreachable PLC again"""
+
     def __init__(self, intermediate_yaml_path, yaml_index):
         self.yaml_index = yaml_index
 
-        with intermediate_yaml_path.open() as yaml_file:
-            self.intermediate_yaml = yaml.load(yaml_file, Loader=yaml.FullLoader)
+        self.intermediate_yaml = load_intermediate_yaml(intermediate_yaml_path)
 
         self.logger = get_logger(self.intermediate_yaml['log_level'])
 
@@ -65,6 +70,15 @@ class GenericPLC(BasePLC):
         if 'actuators' not in self.intermediate_plc:
             self.intermediate_plc['actuators'] = list()
 
+        # Tags of this PLC, and the ip of the PLC owning every other tag, for constant time lookups
+        self.local_tags = frozenset(self.intermediate_plc['sensors'] + self.intermediate_plc['actuators'])
+        self.remote_tag_ips = {}
+        for i, plc_data in enumerate(self.intermediate_yaml["plcs"]):
+            if i == self.yaml_index:
+                continue
+            for tag in plc_data.get("sensors", []) + plc_data.get("actuators", []):
+                self.remote_tag_ips.setdefault(tag, plc_data["public_ip"])
+
         self.intermediate_controls = self.intermediate_plc['controls']
         self.controls = self.create_controls(self.intermediate_controls)
 
@@ -107,6 +121,10 @@ class GenericPLC(BasePLC):
         self.cache = {}
         self.tag_fresh = {}
 
+        # Consecutive failed receives per PLC ip, and the time before which that PLC is not polled
+        self.receive_failures = {}
+        self.receive_retry_time = {}
+
         self.update_cache_flag = False
         self.plcs_ready = False
 
@@ -229,11 +247,13 @@ class GenericPLC(BasePLC):
         sensors = self.generate_tags(self.intermediate_plc['sensors'])
         actuators = self.generate_tags(self.intermediate_plc['actuators'])
 
+        # All initial values are read from the database with a single query
+        initial_values = self.get_multiple(sensors + actuators)
         values = []
         for tag in sensors:
-            values.append(Decimal(self.get(tag)))
+            values.append(Decimal(initial_values[tag]))
         for tag in actuators:
-            values.append(int(self.get(tag)))
+            values.append(int(initial_values[tag]))
 
         noise_scale = self.intermediate_yaml["noise_scale"]
 
@@ -257,7 +277,7 @@ class GenericPLC(BasePLC):
         :rtype: int
         :raise: TagDoesNotExist if tag cannot be found
         """
-        if tag in self.intermediate_plc["sensors"] or tag in self.intermediate_plc["actuators"]:
+        if tag in self.local_tags:
             return Decimal(self.get((tag, 1)))
 
         if tag in self.cache:
@@ -266,53 +286,67 @@ class GenericPLC(BasePLC):
         self.logger.warning(
             "Cache miss in {plc} for tag {tag}".format(plc=self.intermediate_plc["name"], tag=tag))
 
-        for i, plc_data in enumerate(self.intermediate_yaml["plcs"]):
-            if i == self.yaml_index:
-                continue
-            if tag in plc_data["sensors"] or tag in plc_data["actuators"]:
-                received = Decimal(self.receive((tag, 1), plc_data["public_ip"]))
-                return received
+        if tag in self.remote_tag_ips:
+            return Decimal(self.receive((tag, 1), self.remote_tag_ips[tag]))
 
         raise TagDoesNotExist(tag)
 
     def get_tag_for_cache(self, tag, plc_ip, cache_update_time):
+        """
+        Receive a tag from another PLC and store it in the cache.
+        After a failed receive, the time before which that PLC is not polled again is set by an
+        exponential backoff.
+        :return: True if the cache was updated, False if not
+        """
         for retry in range(self.UPDATE_RETRIES):
             try:
                 received = Decimal(self.receive((tag, 1), plc_ip))
                 self.cache[tag] = received
+                self.receive_failures[plc_ip] = 0
                 #self.logger.debug('Received value {value}, from IP {ip}'.format(value=received, ip=plc_ip))
                 return True
             except Exception as e:
                 self.logger.info(
-                    "{plc} receive {tag} from {ip} failed with exception '{e}'".format(
+                    "{plc} receive {tag} from {ip} failed with {type} '{e}'".format(
                         plc=self.intermediate_plc["name"], tag=tag,
-                        ip=plc_ip, e=str(e)))
+                        ip=plc_ip, type=type(e).__name__, e=str(e)))
                 time.sleep(cache_update_time)
                 continue
+
+        self.back_off_receive(plc_ip, cache_update_time, self.RECEIVE_BACKOFF_MAX)
         return False
 
     def update_cache(self, a, cache_update_time):
         """
         Update the cache of this plc by receiving all the required tags.
         When something cannot be received, the previous value is used.
+        Tags of PLCs that are backed off keep their previous value without being polled.
         """
         while self.update_cache_flag:
+            polled = False
             for cached_tag in self.cache:
-                for i, plc_data in enumerate(self.intermediate_yaml["plcs"]):
-                    # Skip ourselves from the cacheupdate. This is done by basePLC module
-                    if i == self.yaml_index:
-                        continue
-
-                    if cached_tag in plc_data["sensors"] or cached_tag in plc_data["actuators"]:
-
-                        start_iteration = self.get_master_clock()
-                        res = self.get_tag_for_cache(cached_tag, plc_data["public_ip"], cache_update_time)
-                        if self.get_master_clock() == start_iteration:
-                            self.tag_fresh[cached_tag] = res
-
-                        if not self.tag_fresh[cached_tag]:
-                            self.logger.info("Warning: Cache for tag " + str(cached_tag) + " could not be updated")
-                            self.tag_fresh[cached_tag] = True
+                # Tags of this PLC are never cached, they are sent by the basePLC module
+                if cached_tag not in self.remote_tag_ips:
+                    continue
+
+                plc_ip = self.remote_tag_ips[cached_tag]
+                if time.time() < self.receive_retry_time.get(plc_ip, 0):
+                    self.tag_fresh[cached_tag] = True
+                    continue
+
+                polled = True
+                start_iteration = self.get_master_clock()
+                res = self.get_tag_for_cache(cached_tag, plc_ip, cache_update_time)
+                if self.get_master_clock() == start_iteration:
+                    self.tag_fresh[cached_tag] = res
+
+                if not self.tag_fresh[cached_tag]:
+                    self.logger.info("Warning: Cache for tag " + str(cached_tag) + " could not be updated")
+                    self.tag_fresh[cached_tag] = True
+
+            # Nothing to receive, do not spin until a PLC can be polled again
+            if not polled:
+                time.sleep(cache_update_time)
 
     def set_tag(self, tag, value):
         """
@@ -321,23 +355,44 @@ class GenericPLC(BasePLC):
         :type tag: str
         :param value: value to set the Tag to
         :raise: TagDoesNotExist if tag is not connected to this plc
+        :raise: InvalidControlValue if value is not a valid status or pump speed
         """
-        if isinstance(value, basestring) and value.lower() == "closed":
-            value = 0
-        elif isinstance(value, basestring) and value.lower() == "open":
-            value = 1
+        if isinstance(value, basestring):
+            try:
+                value = ACTUATOR_STATUS[value.lower()]
+            except KeyError:
+                raise InvalidControlValue(value)
         else:
             self.logger.debug('Pump speed:' + str(value))
             if self.intermediate_yaml['simulator'] == 'wntr':
                 self.logger.error('Pump speed is only supported by epynet and not WNTR simulator')
                 raise InvalidControlValue(value)
 
-        if tag in self.intermediate_plc["sensors"] or tag in self.intermediate_plc["actuators"]:
+        if tag in self.local_tags:
             self.set((tag, 1), value)
         else:
             raise TagDoesNotExist(tag + " cannot be set from " + self.intermediate_plc["name"])
 
-    def db_query(self, query, write=False, parameters=None):
+    def get_multiple(self, tags):
+        """
+        Get the values of multiple tags connected to this PLC with a single query on the database.
+        :param tags: The tags to get, as (tag, pid) tuples
+        :type tags: list
+        :return: dict with the value of every tag found, indexed by the (tag, pid) tuple
+        :raise DatabaseError: When a :code:`sqlite3.OperationalError` is still raised after
+           :code:`DB_TRIES` tries.
+        """
+        if not tags:
+            return {}
+
+        query = "SELECT name, pid, value FROM plant WHERE name IN ({names})".format(
+            names=", ".join("?" * len(tags)))
+        rows = self.db_query(query, False, tuple(tag[0] for tag in tags), fetch_all=True)
+
+        values = {(name, pid): value for name, pid, value in rows}
+        return {tag: values[tag] for tag in tags if tag in values}
+
+    def db_query(self, query, write=False, parameters=None, fetch_all=False):
         """
         Execute a query on the database
         On a :code:`sqlite3.OperationalError` it will retry with a max of :code:`DB_TRIES` tries.
@@ -347,6 +402,7 @@ class GenericPLC(BasePLC):
         :type query: str
         :param write: Boolean flag to indicate if this query will write into the database
         :param parameters: The parameters to put in the query. This must be a tuple.
+        :param fetch_all: Boolean flag to return all result rows instead of the first value
         :raise DatabaseError: When a :code:`sqlite3.OperationalError` is still raised after
            :code:`DB_TRIES` tries.
         """
@@ -361,10 +417,12 @@ class GenericPLC(BasePLC):
                         cur.execute(query)
                     conn.commit()
 
-                    if not write:
-                        return cur.fetchone()[0]
-                    else:
+                    if write:
                         return
+                    elif fetch_all:
+                        return cur.fetchall()
+                    else:
+                        return cur.fetchone()[0]
             except sqlite3.OperationalError as exc:
                 self.logger.info(
                     "Failed to connect to db with exception {exc}. Trying {i} more times.".format(
@@ -436,6 +494,11 @@ class GenericPLC(BasePLC):
         :param test_break:  (Default value = False) used for unit testing, breaks the loop after one iteration
         """
         self.logger.debug(self.intermediate_plc['name'] + ' enters main_loop')
+
+        # Controls and attacks do not change during the simulation, bind their apply methods once
+        apply_controls = [control.apply for control in self.controls]
+        apply_attacks = [attack.apply for attack in self.attacks]
+
         while True:
             # Wait until we acquire the first sync before polling the PLCs
             if not self.plcs_ready:
@@ -459,19 +522,14 @@ class GenericPLC(BasePLC):
                 self.tag_fresh[tag] = False
 
             # We only exit this while when all values are True
-            fresh = False
-            while not fresh:
-                fresh = True
-                for v in self.tag_fresh.values():
-                    fresh = fresh and v
-
-            clock = self.get_master_clock()
+            while not all(self.tag_fresh.values()):
+                pass
 
-            for control in self.controls:
-                control.apply(self)
+            for apply_control in apply_controls:
+                apply_control(self)
 
-            for attack in self.attacks:
-                attack.apply(self)
+            for apply_attack in apply_attacks:
+                apply_attack(self)
 
             self.set_sync(3)
 
@@ -4,19 +4,20 @@ import os.path
 import random
 import signal
 import sqlite3
-import sys
+import threading
 import time
 from collections import OrderedDict
 from datetime import datetime
 from decimal import Decimal
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
 
 from pathlib import Path
 
-import yaml
 from basePLC import BasePLC
 
+from intermediate_loader import load_intermediate_yaml
 from py2_logger import get_logger
-import threading
 import thread
 
 
@@ -49,9 +50,17 @@ class GenericScada(BasePLC):
     SCADA_CACHE_UPDATE_TIME = 2
     """ Time in seconds the SCADA server updates its cache"""
 
+    RECEIVE_BACKOFF_MAX = 16
+    """Maximum time in seconds the SCADA waits before polling an unreachable PLC again"""
+
+    SAVED_VALUES_FLUSH_ROWS = 128
+    """Amount of rows the SCADA buffers before writing them to the csv output"""
+
+    OUTPUT_QUEUE_SIZE = 8
+    """Amount of buffered batches that can wait for the output writer thread"""
+
     def __init__(self, intermediate_yaml_path):
-        with intermediate_yaml_path.open() as yaml_file:
-            self.intermediate_yaml = yaml.load(yaml_file, Loader=yaml.FullLoader)
+        self.intermediate_yaml = load_intermediate_yaml(intermediate_yaml_path)
 
         self.logger = get_logger(self.intermediate_yaml['log_level'])
 
@@ -79,7 +88,9 @@ class GenericScada(BasePLC):
         }
 
         self.plc_data = self.generate_plcs()
-        self.saved_values = [['iteration', 'timestamp']]
+        self.saved_values_header = ['iteration', 'timestamp']
+        # Rows are buffered in saved_values, the whole list is handed to the output writer thread
+        self.saved_values = []
 
         for PLC in self.intermediate_yaml['plcs']:
             if 'sensors' not in PLC:
@@ -87,11 +98,12 @@ class GenericScada(BasePLC):
 
             if 'actuators' not in PLC:
                 PLC['actuators'] = list()
-            self.saved_values[0].extend(PLC['sensors'])
-            self.saved_values[0].extend(PLC['actuators'])
+            self.saved_values_header.extend(PLC['sensors'])
+            self.saved_values_header.extend(PLC['actuators'])
 
         self.update_cache_flag = False
         self.plcs_ready = False
+        self.stop_requested = False
 
         self.previous_cache = {}
         for ip in self.plc_data:
@@ -101,6 +113,10 @@ class GenericScada(BasePLC):
         for ip in self.plc_data:
             self.cache[ip] = [0] * len(self.plc_data[ip])
 
+        # Consecutive failed receives per PLC, and the time before which that PLC is not polled
+        self.receive_failures = {}
+        self.receive_retry_time = {}
+
         self.do_super_construction(scada_protocol, state)
 
     def do_super_construction(self, scada_protocol, state):
@@ -157,12 +173,27 @@ class GenericScada(BasePLC):
         self.logger.debug('SCADA enters pre_loop')
         self.db_sleep_time = random.uniform(0.01, 0.1)
 
+        # The output file is kept open during the simulation, rows are appended in batches
+        self.output_file = self.output_path.open(mode='wb')
+        self.output_writer = csv.writer(self.output_file)
+        self.output_writer.writerow(self.saved_values_header)
+
+        # Batches are written by a separate thread, so main_loop does not wait for the disk
+        self.output_queue = Queue(maxsize=self.OUTPUT_QUEUE_SIZE)
+        self.output_thread = threading.Thread(target=self.drain_output)
+        self.output_thread.daemon = True
+        self.output_thread.start()
+
         signal.signal(signal.SIGINT, self.sigint_handler)
         signal.signal(signal.SIGTERM, self.sigint_handler)
 
         self.keep_updating_flag = True
         self.cache_update_process = None
 
+        # The PLCs are polled concurrently, so one cache update waits for the slowest PLC only
+        self.plc_ips = list(self.plc_data)
+        self.receive_pool = ThreadPool(max(1, len(self.plc_ips)))
+
         time.sleep(sleep)
 
     def db_query(self, query, write=False, parameters=None):
@@ -231,21 +262,48 @@ class GenericScada(BasePLC):
 
     def sigint_handler(self, sig, frame):
         """
-        Shutdown protocol for the scada, writes the output before exiting.
+        Shutdown protocol for the scada. Only asks main_loop to stop, main_loop writes the output
+        before returning. Writing it here could interrupt main_loop halfway through a write.
         """
         self.stop_cache_update()
         self.logger.debug("SCADA shutdown")
-        self.write_output()
-
-        sys.exit(0)
+        self.stop_requested = True
 
     def write_output(self):
         """
-        Writes the csv output of the scada
+        Hands the buffered rows to the output writer thread and empties the buffer.
+        When the queue is full this blocks until there is room, so no rows are lost.
+        """
+        # The buffer itself is queued, main_loop continues with a new one
+        self.output_queue.put(self.saved_values)
+        self.saved_values = []
+
+    def drain_output(self):
+        """
+        Target of the output writer thread. Appends the queued batches to the csv output of the
+        scada until it receives None. The values are written as they were received from the PLCs,
+        csv.writer formats them in C.
+        """
+        while True:
+            batch = self.output_queue.get()
+            if batch is None:
+                return
+            # Keep draining after a failed write, otherwise main_loop blocks on the full queue
+            try:
+                self.output_writer.writerows(
+                    (row[0], datetime.fromtimestamp(row[1])) + row[2:] for row in batch)
+                self.output_file.flush()
+            except Exception as e:
+                self.logger.error("SCADA failed to write {n} rows with {type} '{e}'".format(
+                    n=len(batch), type=type(e).__name__, e=str(e)))
+
+    def stop_output_writer(self):
         """
-        with self.output_path.open(mode='wb') as output:
-            writer = csv.writer(output)
-            writer.writerows(self.saved_values)
+        Waits for the output writer thread to write all queued batches, then closes the csv output.
+        """
+        self.output_queue.put(None)
+        self.output_thread.join()
+        self.output_file.close()
 
     def generate_plcs(self):
         """
@@ -282,73 +340,91 @@ class GenericScada(BasePLC):
         master_time = self.db_query("SELECT time FROM master_time WHERE id IS 1", False, None)
         return master_time
 
-    def update_cache(self, lock, cache_update_time):
+    def update_plc_cache(self, plc_ip):
+        """
+        Update the cache entry of one PLC by receiving all its tags.
+        When something cannot be received, the previous values are used and the PLC
+        is polled again after an exponential backoff.
+        """
+        if time.time() < self.receive_retry_time.get(plc_ip, 0):
+            return
+
+        # Maintain old values if there could not be uploaded
+        try:
+            # Replacing the list of a PLC is atomic, main_loop never sees a partially updated cache entry
+            self.cache[plc_ip] = self.receive_multiple(self.plc_data[plc_ip], plc_ip)
+            self.receive_failures[plc_ip] = 0
+        except Exception as e:
+            backoff = self.back_off_receive(plc_ip, self.SCADA_CACHE_UPDATE_TIME, self.RECEIVE_BACKOFF_MAX)
+            self.logger.error(
+                "PLC receive_multiple with tags {tags} from {ip} failed {n} times with {type} '{e}', "
+                "retrying in {backoff} seconds".format(
+                    tags=self.plc_data[plc_ip], ip=plc_ip, n=self.receive_failures[plc_ip],
+                    type=type(e).__name__, e=str(e), backoff=backoff))
+
+    def update_cache(self, cache_update_time):
         """
         Update the cache of the scada by receiving all the required tags.
-        When something cannot be received, the previous values are used.
+        The PLCs are polled in parallel through the receive pool, every cache_update_time seconds.
         """
+        next_update = time.time() + cache_update_time
 
         while self.update_cache_flag:
-            for plc_ip in self.cache:
-                # Maintain old values if there could not be uploaded
-                try:
-                    values = self.receive_multiple(self.plc_data[plc_ip], plc_ip)
-                    with lock:
-                        self.cache[plc_ip] = values
-                except Exception as e:
-                    self.logger.error(
-                        "PLC receive_multiple with tags {tags} from {ip} failed with exception '{e}'".format(
-                            tags=self.plc_data[plc_ip],
-                            ip=plc_ip, e=str(e)))
-                    continue
-
-                #self.logger.debug(
-                #    "SCADA cache updated for {tags}, with value {values}, from {ip}".format(tags=self.plc_data[plc_ip],
-                #                                                                             values=values,
-                #                                                                             ip=plc_ip))
-
-            time.sleep(cache_update_time)
+            self.receive_pool.map(self.update_plc_cache, self.plc_ips)
+
+            # Sleep until the next update is due, so the time spent polling does not add up
+            remaining = next_update - time.time()
+            if remaining > 0:
+                time.sleep(remaining)
+                next_update += cache_update_time
+            else:
+                next_update = time.time() + cache_update_time
 
     def main_loop(self, sleep=0.5, test_break=False):
         """
         The main loop of a PLC. In here all the controls will be applied.
+        When a shutdown is requested, the remaining output is written and the loop returns.
         :param sleep:  (Default value = 0.5) Not used
         :param test_break:  (Default value = False) used for unit testing, breaks the loop after one iteration
         """
         self.logger.debug("SCADA enters main_loop")
-        lock = None
-
-        while True:
-            while not self.get_sync(0):
+        while not self.stop_requested:
+            while not self.get_sync(0) and not self.stop_requested:
                 time.sleep(self.db_sleep_time)
 
+            if self.stop_requested:
+                break
+
             self.set_sync(1)
 
-            while not self.get_sync(2):
+            while not self.get_sync(2) and not self.stop_requested:
                 pass
 
+            if self.stop_requested:
+                break
+
             if not self.plcs_ready:
                 self.plcs_ready = True
                 self.update_cache_flag = True
                 self.logger.debug("SCADA starting update cache thread")
-                lock = threading.Lock()
-                thread.start_new_thread(self.update_cache, (lock, self.SCADA_CACHE_UPDATE_TIME))
+                thread.start_new_thread(self.update_cache, (self.SCADA_CACHE_UPDATE_TIME,))
 
             master_time = self.get_master_clock()
-            results = [master_time, datetime.now()]
-            with lock:
-                for plc_ip in self.plc_data:
-                    if self.cache[plc_ip]:
-                        results.extend(self.cache[plc_ip])
-                    else:
-                        results.extend(self.previous_cache[plc_ip])
+            # The timestamp is only formatted when the row is written
+            results = [master_time, time.time()]
+            for plc_ip in self.plc_data:
+                if self.cache[plc_ip]:
+                    results.extend(self.cache[plc_ip])
+                else:
+                    results.extend(self.previous_cache[plc_ip])
 
-                self.previous_cache[plc_ip] = self.cache[plc_ip]
+            self.previous_cache[plc_ip] = self.cache[plc_ip]
 
-            self.saved_values.append(results)
+            self.saved_values.append(tuple(results))
 
-            # Save scada_values.csv when needed
-            if 'saving_interval' in self.intermediate_yaml and master_time != 0 and \
+            # Save scada_values.csv when the buffer is full or when needed
+            if len(self.saved_values) == self.SAVED_VALUES_FLUSH_ROWS or \
+                    'saving_interval' in self.intermediate_yaml and master_time != 0 and \
                     master_time % self.intermediate_yaml['saving_interval'] == 0:
                 self.write_output()
 
@@ -357,6 +433,10 @@ class GenericScada(BasePLC):
             if test_break:
                 break
 
+        if self.stop_requested:
+            self.write_output()
+            self.stop_output_writer()
+
 def is_valid_file(parser_instance, arg):
     """
     Verifies whether the intermediate yaml path is valid.
@@ -0,0 +1,64 @@
+import cPickle
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+
+def pickle_path(intermediate_yaml_path):
+    """
+    Gets the path of the pickled copy of an intermediate yaml file
+
+    :param intermediate_yaml_path: path of the intermediate yaml
+    :type intermediate_yaml_path: Path
+    """
+    return intermediate_yaml_path.with_suffix('.pickle')
+
+
+def yaml_stamp(intermediate_yaml_path):
+    """
+    Gets the modification time and size of an intermediate yaml file, which identify the version
+    of the yaml a pickled copy was made from
+
+    :param intermediate_yaml_path: path of the intermediate yaml
+    :type intermediate_yaml_path: Path
+    """
+    yaml_stat = intermediate_yaml_path.stat()
+    return yaml_stat.st_mtime, yaml_stat.st_size
+
+
+def dump_intermediate_pickle(data, intermediate_yaml_path):
+    """
+    Writes a pickled copy of the parsed intermediate yaml next to it, so the processes
+    of an experiment do not all have to parse the same yaml again
+
+    :param data: the parsed intermediate yaml
+    :param intermediate_yaml_path: path of the intermediate yaml
+    :type intermediate_yaml_path: Path
+    """
+    with pickle_path(intermediate_yaml_path).open(mode='wb') as pickle_file:
+        cPickle.dump((yaml_stamp(intermediate_yaml_path), data), pickle_file, cPickle.HIGHEST_PROTOCOL)
+
+
+def load_intermediate_yaml(intermediate_yaml_path):
+    """
+    Loads an intermediate yaml file. When a pickled copy of this exact version of the yaml
+    exists, that copy is loaded instead of parsing the yaml. The version is compared by the
+    modification time and size of the yaml, comparing only which file is more recent could load
+    an outdated copy when both were written within the resolution of the modification times.
+
+    :param intermediate_yaml_path: path of the intermediate yaml
+    :type intermediate_yaml_path: Path
+    """
+    intermediate_pickle_path = pickle_path(intermediate_yaml_path)
+    if intermediate_pickle_path.exists():
+        with intermediate_pickle_path.open(mode='rb') as pickle_file:
+            pickled_stamp, data = cPickle.load(pickle_file)
+        if pickled_stamp == yaml_stamp(intermediate_yaml_path):
+            return data
+
+    with intermediate_yaml_path.open() as yaml_file:
+        return yaml.load(yaml_file, Loader=YamlLoader)
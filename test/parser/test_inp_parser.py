@@ -1,9 +1,10 @@
+import os
 import sys
 import pytest
 import yaml
 from pathlib import Path
 
-from dhalsim.parser.input_parser import InputParser
+from dhalsim.parser.input_parser import InputParser, NotEnoughInitialValues
 
 
 @pytest.fixture
@@ -45,3 +46,66 @@ def test_node_and_time_controls(tmpdir, written_intermediate_yaml, filled_yaml_p
         expected = yaml.safe_load(expectation)
 
     assert filled_data == expected
+
+
+@pytest.fixture
+def csv_batch_dict(tmpdir, inp_path):
+    delays = tmpdir.join("delays.csv")
+    delays.write("r1,r2\n10,5.5\n20,6.5\n30,7.5\n")
+    return {"inp_file": str(inp_path), "log_level": "info", "simulator": "wntr",
+            "batch_simulations": 2, "batch_index": 1, "network_delay_data": str(delays),
+            "plcs": [{"name": "PLC1", "actuators": ["P_RAW1", "V_PUB"], "sensors": ["T0"]}]}
+
+
+def test_read_csv_row_batch_index(csv_batch_dict):
+    parser = InputParser(csv_batch_dict)
+    parser.generate_network_delays()
+
+    assert parser.data['network_delay_values'] == {'r1': '20ms', 'r2': '6.5ms'}
+
+
+def test_read_csv_row_not_enough_rows(csv_batch_dict):
+    csv_batch_dict["batch_simulations"] = 4
+    parser = InputParser(csv_batch_dict)
+
+    with pytest.raises(NotEnoughInitialValues):
+        parser.generate_network_delays()
+
+
+def test_load_controls_cached(tmpdir, monkeypatch, csv_batch_dict):
+    monkeypatch.setattr("tempfile.tempdir", str(tmpdir))
+    expected = InputParser(csv_batch_dict).load_controls()
+
+    parser = InputParser(csv_batch_dict)
+    monkeypatch.setattr(parser, "parse_controls", lambda: pytest.fail("controls were parsed again"))
+
+    assert parser.controls_cache_path().parent == Path(str(tmpdir)) / f"dhalsim-{os.getuid()}"
+    assert parser.load_controls() == expected
+
+
+def test_load_controls_not_private(tmpdir, monkeypatch, csv_batch_dict):
+    monkeypatch.setattr("tempfile.tempdir", str(tmpdir))
+    cache_dir = tmpdir.mkdir(f"dhalsim-{os.getuid()}")
+    cache_dir.chmod(0o777)
+
+    parser = InputParser(csv_batch_dict)
+    with pytest.raises(OSError):
+        parser.controls_cache_path()
+
+    # Assert the controls are still parsed, but not cached in a directory other users can write to
+    assert parser.load_controls() == parser.parse_controls()
+    assert cache_dir.listdir() == []
+
+
+def test_read_csv_row_dtype(tmpdir, csv_batch_dict):
+    tmpdir.join("delays.csv").write("r1,r2\n10,5.5\n20.5,6\n")
+    tmpdir.join("losses.csv").write("r1\n1\n0.5\n")
+    csv_batch_dict["network_loss_data"] = str(tmpdir.join("losses.csv"))
+    del csv_batch_dict["batch_simulations"]
+    parser = InputParser(csv_batch_dict)
+    parser.generate_network_delays()
+    parser.generate_network_losses()
+
+    # Assert values do not depend on the rows that were not read
+    assert parser.data['network_delay_values'] == {'r1': '10ms', 'r2': '5.5ms'}
+    assert parser.data['network_loss_values'] == {'r1': 1.0}
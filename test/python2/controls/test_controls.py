@@ -1,4 +1,5 @@
 import unittest
+from decimal import Decimal
 from mock import MagicMock, call
 import sys
 import pytest
@@ -62,6 +63,7 @@ def test_below_properties(below_fixture):
     assert below_fixture.action == "action1"
     assert below_fixture.dependant == "testTank1"
     assert below_fixture.value == 41
+    assert below_fixture.threshold == Decimal(41)
 
 
 def test_above_properties(above_fixture):
@@ -69,6 +71,7 @@ def test_above_properties(above_fixture):
     assert above_fixture.action == "action2"
     assert above_fixture.dependant == "testTank2"
     assert above_fixture.value == 42
+    assert above_fixture.threshold == Decimal(42)
 
 
 def test_time_properties(time_fixture):
@@ -1,4 +1,5 @@
 import sys
+import threading
 from decimal import Decimal
 
 import pytest
@@ -8,7 +9,7 @@ from mock import MagicMock, call
 from pathlib import Path
 
 from dhalsim.python2.entities.control import AboveControl, BelowControl, TimeControl
-from dhalsim.python2.generic_plc import GenericPLC
+from dhalsim.python2.generic_plc import GenericPLC, InvalidControlValue
 
 
 @pytest.fixture
@@ -18,9 +19,11 @@ def magic_mock_network():
     mock.get.return_value = u'42'
     mock.set.return_value = u'42'
     mock.receive.return_value = u'0.15'
-    # database
-    mock.get_sync.return_value = 0
+    mock.get_multiple.side_effect = lambda tags: {tag: u'42' for tag in tags}
+    # database, a single iteration of the sync flags
+    mock.get_sync.side_effect = [True, True]
     mock.set_sync.return_value = None
+    mock.get_master_clock.return_value = 1
     return mock
 
 
@@ -28,7 +31,6 @@ def magic_mock_network():
 def magic_mock_init():
     mock = MagicMock()
     mock.do_super_construction.return_value = None
-    mock.initialize_db.return_value = None
     return mock
 
 
@@ -37,7 +39,6 @@ def magic_mock_preloop():
     mock = MagicMock()
     mock.set_parameters.return_value = None
     mock.startup.return_value = None
-    mock.Lock.return_value = "testLock"
     return mock
 
 
@@ -46,6 +47,7 @@ def yaml_file(tmpdir):
     dict = {
         "log_level": "info",
         "db_path": "/home/test/dhalsim.sqlite",
+        "noise_scale": 0,
         "plcs": [{"name": "PLC1",
                   "local_ip": "192.168.1.1",
                   "public_ip": "192.168.1.1",
@@ -77,10 +79,6 @@ def yaml_file(tmpdir):
 
 def patch_methods(magic_mock_init, magic_mock_preloop, magic_mock_network, mocker):
     # Init mocker patches
-    mocker.patch(
-        'dhalsim.python2.generic_plc.GenericPLC.initialize_db',
-        magic_mock_init.initialize_db
-    )
     mocker.patch(
         'dhalsim.python2.generic_plc.GenericPLC.do_super_construction',
         magic_mock_init.do_super_construction
@@ -94,10 +92,6 @@ def patch_methods(magic_mock_init, magic_mock_preloop, magic_mock_network, mocke
         'dhalsim.python2.basePLC.BasePLC.startup',
         magic_mock_preloop.startup
     )
-    mocker.patch(
-        'threading.Lock',
-        magic_mock_preloop.Lock
-    )
     # Network mocker patches
     mocker.patch(
         'dhalsim.python2.generic_plc.GenericPLC.get',
@@ -111,16 +105,43 @@ def patch_methods(magic_mock_init, magic_mock_preloop, magic_mock_network, mocke
         'dhalsim.python2.generic_plc.GenericPLC.receive',
         magic_mock_network.receive
     )
+    mocker.patch(
+        'dhalsim.python2.generic_plc.GenericPLC.get_multiple',
+        magic_mock_network.get_multiple
+    )
     mocker.patch(
         'dhalsim.python2.generic_plc.GenericPLC.get_sync',
         magic_mock_network.get_sync
     )
+    mocker.patch(
+        'dhalsim.python2.generic_plc.GenericPLC.get_master_clock',
+        magic_mock_network.get_master_clock
+    )
+    mocker.patch(
+        'dhalsim.python2.basePLC.BasePLC.send_system_state',
+        magic_mock_network.send_system_state
+    )
     mocker.patch(
         'dhalsim.python2.generic_plc.GenericPLC.set_sync',
         magic_mock_network.set_sync
     )
 
 
+def run_main_loop(plc, mocker):
+    """Runs one iteration of main_loop, with a cache thread that is stopped afterwards"""
+    threads = []
+
+    def start_thread(function, args):
+        threads.append(threading.Thread(target=function, args=args))
+        threads[-1].start()
+
+    mocker.patch('thread.start_new_thread', side_effect=start_thread)
+    plc.main_loop(test_break=True)
+    plc.update_cache_flag = False
+    for cache_thread in threads:
+        cache_thread.join()
+
+
 @pytest.fixture
 def generic_plc1(mocker, yaml_file, magic_mock_init, magic_mock_preloop, magic_mock_network):
     patch_methods(magic_mock_init, magic_mock_preloop, magic_mock_network, mocker)
@@ -159,9 +180,11 @@ def test_generic_plc1_init(generic_plc1, magic_mock_init, yaml_file):
     assert generic_plc1.controls[0].dependant == "T2"
     assert generic_plc1.controls[0].action == "OPEN"
     assert generic_plc1.controls[0].actuator == "P_RAW1"
+    # Assert tag lookups
+    assert generic_plc1.local_tags == frozenset(["T0", "P_RAW1"])
+    assert generic_plc1.remote_tag_ips == {"T2": "192.168.1.2", "V_ER2i": "192.168.1.2"}
     # Assert proper function calls
-    expected_calls = [call.initialize_db(),
-                      call.do_super_construction(
+    expected_calls = [call.do_super_construction(
                           {'server': {'tags': (('T0', 1, 'REAL'), ('T2', 1, 'REAL'), ('P_RAW1', 1, 'REAL')),
                                       'address': '192.168.1.1'}, 'name': 'enip', 'mode': 1},
                           {'path': '/home/test/dhalsim.sqlite', 'name': 'plant'})]
@@ -190,8 +213,7 @@ def test_generic_plc2_init(generic_plc2, magic_mock_init, yaml_file):
     assert generic_plc2.controls[0].action == "CLOSED"
     assert generic_plc2.controls[0].actuator == "V_ER2i"
     # Assert proper function calls
-    expected_calls = [call.initialize_db(),
-                      call.do_super_construction({'server': {'tags': (('T2', 1, 'REAL'), ('V_ER2i', 1, 'REAL')),
+    expected_calls = [call.do_super_construction({'server': {'tags': (('T2', 1, 'REAL'), ('V_ER2i', 1, 'REAL')),
                                                              'address': '192.168.1.2'}, 'name': 'enip', 'mode': 1},
                                                  {'path': '/home/test/dhalsim.sqlite', 'name': 'plant'})]
     assert magic_mock_init.mock_calls == expected_calls
@@ -200,48 +222,93 @@ def test_generic_plc2_init(generic_plc2, magic_mock_init, yaml_file):
 def test_generic_plc1_preloop(generic_plc1, magic_mock_preloop, magic_mock_network):
     generic_plc1.pre_loop()
     # Verify pre loop function calls
-    expected_preloop_calls = [call.Lock(),
-                              call.set_parameters(generic_plc1,
-                                                  [('T0', 1), ('P_RAW1', 1)],
-                                                  [Decimal('42'), 42], True,
-                                                  'testLock', '192.168.1.1'),
+    expected_preloop_calls = [call.set_parameters(generic_plc1, [('T0', 1)], [('P_RAW1', 1)],
+                                                  [Decimal('42'), 42], '192.168.1.1', 0),
                               call.startup()]
     assert magic_mock_preloop.mock_calls == expected_preloop_calls
-    # Verify network function calls
-    expected_network_calls = [call.get(('T0', 1)), call.get(('P_RAW1', 1))]
+    # Verify the initial values are read with a single query
+    expected_network_calls = [call.get_multiple([('T0', 1), ('P_RAW1', 1)])]
     assert magic_mock_network.mock_calls == expected_network_calls
 
 
 def test_generic_plc2_preloop(generic_plc2, magic_mock_preloop, magic_mock_network):
     generic_plc2.pre_loop()
     # Verify pre loop function calls
-    expected_preloop_calls = [call.Lock(),
-                              call.set_parameters(generic_plc2,
-                                                  [('T2', 1), ('V_ER2i', 1)],
-                                                  [Decimal('42'), 42], True,
-                                                  'testLock', '192.168.1.2'),
+    expected_preloop_calls = [call.set_parameters(generic_plc2, [('T2', 1)], [('V_ER2i', 1)],
+                                                  [Decimal('42'), 42], '192.168.1.2', 0),
                               call.startup()]
     assert magic_mock_preloop.mock_calls == expected_preloop_calls
-    # Verify network function calls
-    expected_network_calls = [call.get(('T2', 1)), call.get(('V_ER2i', 1))]
+    # Verify the initial values are read with a single query
+    expected_network_calls = [call.get_multiple([('T2', 1), ('V_ER2i', 1)])]
     assert magic_mock_network.mock_calls == expected_network_calls
 
 
-def test_generic_plc1_mainloop(generic_plc1, magic_mock_network):
-    generic_plc1.main_loop(test_break=True)
+def test_generic_plc1_mainloop(generic_plc1, magic_mock_network, mocker):
+    run_main_loop(generic_plc1, mocker)
     # Verify network function calls (applying control rule)
-    expected_network_calls = [call.get_sync(),
-                              call.receive(('T2', 1), '192.168.1.2'),
-                              call.set(('P_RAW1', 1), 1),
-                              call.set_sync(1)]
-    assert magic_mock_network.mock_calls == expected_network_calls
+    assert magic_mock_network.get_sync.mock_calls == [call(0), call(2)]
+    # The cache thread polls continuously, every poll is for the remote tag of the control
+    assert magic_mock_network.receive.call_count > 0
+    assert all(poll == call(('T2', 1), '192.168.1.2') for poll in magic_mock_network.receive.mock_calls)
+    assert magic_mock_network.set.mock_calls == [call(('P_RAW1', 1), 1)]
+    assert magic_mock_network.set_sync.mock_calls == [call(1), call(3)]
 
 
-def test_generic_plc2_mainloop(generic_plc2, magic_mock_network):
-    generic_plc2.main_loop(test_break=True)
+def test_generic_plc2_mainloop(generic_plc2, magic_mock_network, mocker):
+    run_main_loop(generic_plc2, mocker)
     # Verify network function calls (applying control rule)
-    expected_network_calls = [call.get_sync(),
-                              call.get(('T2', 1)),
-                              call.set(('V_ER2i', 1), 0),
-                              call.set_sync(1)]
-    assert magic_mock_network.mock_calls == expected_network_calls
+    assert magic_mock_network.get_sync.mock_calls == [call(0), call(2)]
+    assert magic_mock_network.get.mock_calls == [call(('T2', 1))]
+    assert magic_mock_network.receive.mock_calls == []
+    assert magic_mock_network.set.mock_calls == [call(('V_ER2i', 1), 0)]
+    assert magic_mock_network.set_sync.mock_calls == [call(1), call(3)]
+
+
+def test_generic_plc1_set_tag(generic_plc1, magic_mock_network):
+    generic_plc1.set_tag("P_RAW1", "OPEN")
+    generic_plc1.set_tag("P_RAW1", "closed")
+    assert magic_mock_network.set.mock_calls == [call(('P_RAW1', 1), 1), call(('P_RAW1', 1), 0)]
+
+    with pytest.raises(InvalidControlValue):
+        generic_plc1.set_tag("P_RAW1", "HALF")
+
+
+def test_generic_plc1_update_cache_backoff(generic_plc1, magic_mock_network, mocker):
+    magic_mock_network.receive.side_effect = Exception
+    mocker.patch('time.time', return_value=100)
+    clock = mocker.patch.object(GenericPLC, 'get_master_clock', return_value=1)
+    sleeper = mocker.patch('time.sleep')
+
+    # Stop updating on the second sleep, after the failed receive has been retried
+    def stop_updating(seconds):
+        if sleeper.call_count == 2:
+            generic_plc1.update_cache_flag = False
+
+    sleeper.side_effect = stop_updating
+    generic_plc1.update_cache_flag = True
+    generic_plc1.update_cache('a', 0.05)
+
+    # Assert the unreachable PLC was polled once and then backed off
+    assert magic_mock_network.receive.call_count == GenericPLC.UPDATE_RETRIES
+    assert generic_plc1.receive_retry_time == {'192.168.1.2': 100.05}
+    assert clock.call_count == 2
+    # Assert the backed off tag keeps its previous value and the thread sleeps instead of spinning
+    assert generic_plc1.tag_fresh == {'T2': True}
+    assert sleeper.mock_calls == [call(0.05), call(0.05)]
+
+
+def test_generic_plc1_get_tag_for_cache_backoff_max(generic_plc1, magic_mock_network, mocker):
+    magic_mock_network.receive.side_effect = Exception
+    mocker.patch('time.time', return_value=100)
+    mocker.patch('time.sleep')
+
+    generic_plc1.get_tag_for_cache('T2', '192.168.1.2', 0.05)
+    generic_plc1.get_tag_for_cache('T2', '192.168.1.2', 0.05)
+    # Assert the backoff doubles after the second consecutive failure
+    assert generic_plc1.receive_retry_time['192.168.1.2'] == 100.1
+
+    generic_plc1.receive_failures['192.168.1.2'] = 10
+    generic_plc1.get_tag_for_cache('T2', '192.168.1.2', 0.05)
+    # Assert the backoff is capped
+    assert generic_plc1.receive_failures['192.168.1.2'] == 11
+    assert generic_plc1.receive_retry_time['192.168.1.2'] == 100 + GenericPLC.RECEIVE_BACKOFF_MAX
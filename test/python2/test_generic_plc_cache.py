@@ -1,4 +1,5 @@
 import sys
+import threading
 from pathlib import Path
 
 import pytest
@@ -15,9 +16,10 @@ def magic_mock_network():
     mock.get.return_value = u'42'
     mock.set.return_value = u'42'
     mock.receive.return_value = u'0.15'
-    # database
-    mock.get_sync.return_value = 0
+    # database, a single iteration of the sync flags
+    mock.get_sync.side_effect = [True, True]
     mock.set_sync.return_value = None
+    mock.get_master_clock.return_value = 1
     return mock
 
 
@@ -25,7 +27,6 @@ def magic_mock_network():
 def magic_mock_init():
     mock = MagicMock()
     mock.do_super_construction.return_value = None
-    mock.initialize_db.return_value = None
     return mock
 
 
@@ -70,10 +71,6 @@ def yaml_file(tmpdir):
 
 def patch_methods(magic_mock_init, magic_mock_network, mocker):
     # Init mocker patches
-    mocker.patch(
-        'dhalsim.python2.generic_plc.GenericPLC.initialize_db',
-        magic_mock_init.initialize_db
-    )
     mocker.patch(
         'dhalsim.python2.generic_plc.GenericPLC.do_super_construction',
         magic_mock_init.do_super_construction
@@ -95,12 +92,35 @@ def patch_methods(magic_mock_init, magic_mock_network, mocker):
         'dhalsim.python2.generic_plc.GenericPLC.get_sync',
         magic_mock_network.get_sync
     )
+    mocker.patch(
+        'dhalsim.python2.generic_plc.GenericPLC.get_master_clock',
+        magic_mock_network.get_master_clock
+    )
+    mocker.patch(
+        'dhalsim.python2.basePLC.BasePLC.send_system_state',
+        magic_mock_network.send_system_state
+    )
     mocker.patch(
         'dhalsim.python2.generic_plc.GenericPLC.set_sync',
         magic_mock_network.set_sync
     )
 
 
+def run_main_loop(plc, mocker):
+    """Runs one iteration of main_loop, with a cache thread that is stopped afterwards"""
+    threads = []
+
+    def start_thread(function, args):
+        threads.append(threading.Thread(target=function, args=args))
+        threads[-1].start()
+
+    mocker.patch('thread.start_new_thread', side_effect=start_thread)
+    plc.main_loop(test_break=True)
+    plc.update_cache_flag = False
+    for cache_thread in threads:
+        cache_thread.join()
+
+
 @pytest.fixture
 def generic_plc1(mocker, yaml_file, magic_mock_init, magic_mock_network):
     patch_methods(magic_mock_init, magic_mock_network, mocker)
@@ -112,12 +132,19 @@ def test_python_version():
     assert sys.version_info.minor is 7
 
 
-def test_generic_plc1_cache(generic_plc1, magic_mock_network):
-    generic_plc1.main_loop(test_break=True)
+def test_generic_plc1_cache(generic_plc1, magic_mock_network, mocker):
+    receiving_threads = set()
+
+    def receive(tag, plc_ip):
+        receiving_threads.add(threading.current_thread())
+        return u'0.15'
+
+    magic_mock_network.receive.side_effect = receive
+    run_main_loop(generic_plc1, mocker)
+    # Verify both controls used the cached value, only the cache thread receives from the network
+    assert magic_mock_network.receive.call_count > 0
+    assert threading.current_thread() not in receiving_threads
+    assert all(poll == call(('T2', 1), '192.168.1.2') for poll in magic_mock_network.receive.mock_calls)
     # Verify network function calls (applying control rule)
-    expected_network_calls = [call.get_sync(),
-                              call.receive(('T2', 1), '192.168.1.2'),  # Only called once
-                              call.set(('P_RAW1', 1), 1),
-                              call.set(('P_RAW1', 1), 0),
-                              call.set_sync(1)]
-    assert magic_mock_network.mock_calls == expected_network_calls
+    assert magic_mock_network.set.mock_calls == [call(('P_RAW1', 1), 1), call(('P_RAW1', 1), 0)]
+    assert magic_mock_network.set_sync.mock_calls == [call(1), call(3)]
@@ -10,15 +10,17 @@ def patched_plc(mocker):
     sleeper = mocker.patch("time.sleep", return_value=None)
     mocker.patch.object(GenericPLC, "__init__", return_value=None)
     mocker.patch.object(GenericPLC, "DB_TRIES", 3)
-    mocker.patch.object(GenericPLC, "DB_SLEEP_TIME", 1.5)
     cur_mock = mocker.Mock()
-    conn_mock = mocker.Mock()
+    conn_mock = mocker.MagicMock()
+    conn_mock.__enter__.return_value = conn_mock
+    conn_mock.cursor.return_value = cur_mock
+    mocker.patch("sqlite3.connect", return_value=conn_mock)
     logger_mock = mocker.Mock()
 
     plc = GenericPLC()
-    plc.cur = cur_mock
-    plc.conn = conn_mock
     plc.logger = logger_mock
+    plc.db_sleep_time = 1.5
+    plc.intermediate_yaml = {'db_path': '/home/test/dhalsim.sqlite'}
     plc.intermediate_plc = {
         'name': 'patched_plc'
     }
@@ -37,7 +39,7 @@ def test_get_master_clock_first_try(patched_plc):
 
     cur_mock.fetchone.assert_called_once()
 
-    assert logger_mock.debug.call_count == 0
+    assert logger_mock.info.call_count == 0
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_not_called()
@@ -58,7 +60,7 @@ def test_get_master_clock_fail_once(patched_plc):
 
     cur_mock.fetchone.assert_called_once()
 
-    assert logger_mock.debug.call_count == 1
+    assert logger_mock.info.call_count == 1
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_called_once_with(1.5)
@@ -80,7 +82,7 @@ def test_get_master_clock_fail_all(patched_plc):
 
     cur_mock.fetchone.assert_not_called()
 
-    assert logger_mock.debug.call_count == 3
+    assert logger_mock.info.call_count == 3
     assert logger_mock.error.call_count == 1
 
     sleeper.assert_has_calls([call(1.5), call(1.5), call(1.5)])
@@ -92,13 +94,13 @@ def test_get_sync_first_try(patched_plc):
 
     cur_mock.fetchone.return_value = [1]
 
-    assert plc.get_sync() is True
+    assert plc.get_sync(1) is True
 
     cur_mock.execute.assert_called_once_with("SELECT flag FROM sync WHERE name IS ?", ('patched_plc',))
 
     cur_mock.fetchone.assert_called_once()
 
-    assert logger_mock.debug.call_count == 0
+    assert logger_mock.info.call_count == 0
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_not_called()
@@ -111,7 +113,7 @@ def test_get_sync_fail_once(patched_plc):
 
     cur_mock.fetchone.return_value = [1]
 
-    assert plc.get_sync() is True
+    assert plc.get_sync(1) is True
 
     cur_mock.execute.assert_has_calls([call("SELECT flag FROM sync WHERE name IS ?", ('patched_plc',)),
                                        call("SELECT flag FROM sync WHERE name IS ?", ('patched_plc',))])
@@ -119,7 +121,7 @@ def test_get_sync_fail_once(patched_plc):
 
     cur_mock.fetchone.assert_called_once()
 
-    assert logger_mock.debug.call_count == 1
+    assert logger_mock.info.call_count == 1
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_called_once_with(1.5)
@@ -132,7 +134,7 @@ def test_get_sync_fail_all(patched_plc):
                                     sqlite3.OperationalError(), None]
 
     with pytest.raises(DatabaseError):
-        plc.get_sync()
+        plc.get_sync(1)
 
     cur_mock.execute.assert_has_calls([call("SELECT flag FROM sync WHERE name IS ?", ('patched_plc',)),
                                        call("SELECT flag FROM sync WHERE name IS ?", ('patched_plc',)),
@@ -141,7 +143,7 @@ def test_get_sync_fail_all(patched_plc):
 
     cur_mock.fetchone.assert_not_called()
 
-    assert logger_mock.debug.call_count == 3
+    assert logger_mock.info.call_count == 3
     assert logger_mock.error.call_count == 1
 
     sleeper.assert_has_calls([call(1.5),call(1.5),call(1.5)])
@@ -157,7 +159,7 @@ def test_set_sync_first_try(patched_plc):
 
     conn_mock.commit.assert_called_once()
 
-    assert logger_mock.debug.call_count == 0
+    assert logger_mock.info.call_count == 0
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_not_called()
@@ -176,7 +178,7 @@ def test_set_sync_fail_once(patched_plc):
 
     conn_mock.commit.assert_called_once()
 
-    assert logger_mock.debug.call_count == 1
+    assert logger_mock.info.call_count == 1
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_called_once_with(1.5)
@@ -198,7 +200,7 @@ def test_set_sync_fail_all(patched_plc):
 
     conn_mock.commit.assert_not_called()
 
-    assert logger_mock.debug.call_count == 3
+    assert logger_mock.info.call_count == 3
     assert logger_mock.error.call_count == 1
 
     sleeper.assert_has_calls([call(1.5),call(1.5),call(1.5)])
@@ -214,7 +216,7 @@ def test_set_attack_flag_first_try(patched_plc):
 
     conn_mock.commit.assert_called_once()
 
-    assert logger_mock.debug.call_count == 0
+    assert logger_mock.info.call_count == 0
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_not_called()
@@ -233,7 +235,7 @@ def test_set_attack_flag_fail_once(patched_plc):
 
     conn_mock.commit.assert_called_once()
 
-    assert logger_mock.debug.call_count == 1
+    assert logger_mock.info.call_count == 1
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_called_once_with(1.5)
@@ -255,8 +257,23 @@ def test_set_attack_flag_fail_all(patched_plc):
 
     conn_mock.commit.assert_not_called()
 
-    assert logger_mock.debug.call_count == 3
+    assert logger_mock.info.call_count == 3
     assert logger_mock.error.call_count == 1
 
     sleeper.assert_has_calls([call(1.5),call(1.5),call(1.5)])
     assert sleeper.call_count == 3
+
+
+def test_get_multiple(patched_plc):
+    plc, cur_mock, conn_mock, logger_mock, sleeper = patched_plc
+
+    cur_mock.fetchall.return_value = [('T0', 1, '0.42'), ('P_RAW1', 1, '1')]
+
+    assert plc.get_multiple([('T0', 1), ('P_RAW1', 1)]) == {('T0', 1): '0.42', ('P_RAW1', 1): '1'}
+
+    cur_mock.execute.assert_called_once_with("SELECT name, pid, value FROM plant WHERE name IN (?, ?)",
+                                             ('T0', 'P_RAW1'))
+    assert plc.get_multiple([]) == {}
+    assert cur_mock.execute.call_count == 1
+
+    sleeper.assert_not_called()
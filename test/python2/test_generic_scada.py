@@ -1,3 +1,4 @@
+import itertools
 import sys
 from collections import OrderedDict
 from datetime import datetime
@@ -19,8 +20,8 @@ def magic_mock_scada_network():
     mock.receive_multiple.side_effect = [['0.420420', '1'], ['0.350420', '0'],
                                          Exception, Exception,
                                          ['100', '100'], Exception]
-    # database
-    mock.get_sync.return_value = 0
+    # database, three iterations of the sync flags
+    mock.get_sync.side_effect = [True, True] * 3
     mock.set_sync.return_value = None
     return mock
 
@@ -29,7 +30,6 @@ def magic_mock_scada_network():
 def magic_mock_scada_init():
     mock = MagicMock()
     mock.do_super_construction.return_value = None
-    mock.initialize_db.return_value = None
     mock.touch.return_value = None
     return mock
 
@@ -53,7 +53,7 @@ def yaml_scada_file(tmpdir):
     dict = {
         "log_level": "info",
         "db_path": "/home/test/dhalsim.sqlite",
-        "output_path": "/home/test/dhalsim/output",
+        "output_path": str(tmpdir),
         "scada": {"name": "scada",
                   "local_ip": "192.168.2.1",
                   "public_ip": "192.168.2.1"},
@@ -92,10 +92,6 @@ def yaml_scada_file(tmpdir):
 def patch_methods(magic_mock_scada_init, magic_mock_scada_preloop, magic_mock_scada_clock, magic_mock_scada_network,
                   mocker):
     # Init mocker patches
-    mocker.patch(
-        'dhalsim.python2.generic_scada.GenericScada.initialize_db',
-        magic_mock_scada_init.initialize_db
-    )
     mocker.patch(
         'dhalsim.python2.generic_scada.GenericScada.do_super_construction',
         magic_mock_scada_init.do_super_construction
@@ -129,6 +125,12 @@ def patch_methods(magic_mock_scada_init, magic_mock_scada_preloop, magic_mock_sc
     )
 
 
+def update_cache_in_main_loop(generic_scada, mocker):
+    """Replaces the cache thread by a single cache update of every PLC, in plc_data order"""
+    mocker.patch('thread.start_new_thread',
+                 side_effect=lambda function, args: [generic_scada.update_plc_cache(ip) for ip in generic_scada.plc_ips])
+
+
 @pytest.fixture
 def generic_scada(mocker, yaml_scada_file, magic_mock_scada_init, magic_mock_scada_preloop, magic_mock_scada_clock,
                   magic_mock_scada_network):
@@ -149,7 +151,7 @@ def test_generic_scada_init(generic_scada, magic_mock_scada_init, yaml_scada_fil
     # Assert same as scada yaml
     assert generic_scada.intermediate_yaml == test_yaml
     # Assert output path
-    assert str(generic_scada.output_path) == "/home/test/dhalsim/output/scada_values.csv"
+    assert str(generic_scada.output_path) == str(yaml_scada_file.dirpath().join("scada_values.csv"))
     # Assert plc data generation
     assert generic_scada.plc_data == OrderedDict([('192.168.1.1', [('T0', 1), ('P_RAW1', 1)]),
                                                   ('192.168.1.2', [('T2', 1), ('V_ER2i', 1)])])
@@ -157,9 +159,10 @@ def test_generic_scada_init(generic_scada, magic_mock_scada_init, yaml_scada_fil
     assert generic_scada.cache == {'192.168.1.1': [0, 0],
                                    '192.168.1.2': [0, 0]}
     # Assert plc saved values generation
-    assert generic_scada.saved_values == [['iteration', 'timestamp', 'T0', 'P_RAW1', 'T2', 'V_ER2i']]
+    assert generic_scada.saved_values_header == ['iteration', 'timestamp', 'T0', 'P_RAW1', 'T2', 'V_ER2i']
+    assert generic_scada.saved_values == []
     # Assert proper function calls
-    expected_calls = [call.initialize_db(), call.touch(exist_ok=True),
+    expected_calls = [call.touch(exist_ok=True),
                       call.do_super_construction({'server': {
                           'tags': (('T0', 1, 'REAL'), ('P_RAW1', 1, 'REAL'), ('T2', 1, 'REAL'), ('V_ER2i', 1, 'REAL')),
                           'address': '192.168.2.1'}, 'name': 'enip', 'mode': 1},
@@ -175,28 +178,146 @@ def test_generic_scada_preloop(generic_scada, magic_mock_scada_preloop):
     assert magic_mock_scada_preloop.mock_calls == expected_calls
 
 
-def test_generic_scada_mainloop(generic_scada, magic_mock_scada_network, magic_mock_scada_clock, yaml_scada_file):
+def test_generic_scada_mainloop(generic_scada, magic_mock_scada_network, magic_mock_scada_clock, mocker):
+    generic_scada.pre_loop(sleep=0)
+    update_cache_in_main_loop(generic_scada, mocker)
     generic_scada.main_loop(test_break=True)
     # Assert saved_values has been properly modified
-    assert generic_scada.saved_values == [['iteration', 'timestamp', 'T0', 'P_RAW1', 'T2', 'V_ER2i'],
-                                          [2, generic_scada.saved_values[1][1], '0.350420', '0', '0.420420', '1']]
+    assert generic_scada.saved_values == \
+        [(2, generic_scada.saved_values[0][1], '0.420420', '1', '0.350420', '0')]
     # Assert proper function calls
-    expected_network_calls = sorted([call.get_sync(),
-                                     call.receive_multiple([('T0', 1), ('P_RAW1', 1)], '192.168.1.1'),
-                                     call.receive_multiple([('T2', 1), ('V_ER2i', 1)], '192.168.1.2'),
-                                     call.set_sync(1)])
+    expected_network_calls = [call.get_sync(0),
+                              call.set_sync(1),
+                              call.get_sync(2),
+                              call.receive_multiple([('T0', 1), ('P_RAW1', 1)], '192.168.1.1'),
+                              call.receive_multiple([('T2', 1), ('V_ER2i', 1)], '192.168.1.2'),
+                              call.set_sync(3)]
     expected_clock_calls = [call.get_master_clock()]
-    assert sorted(magic_mock_scada_network.mock_calls) == expected_network_calls
+    assert magic_mock_scada_network.mock_calls == expected_network_calls
     assert magic_mock_scada_clock.mock_calls == expected_clock_calls
 
 
-def test_generic_scada_cache(generic_scada, magic_mock_scada_network, magic_mock_scada_clock, yaml_scada_file):
+def test_generic_scada_cache(generic_scada, magic_mock_scada_network, magic_mock_scada_clock, mocker):
+    generic_scada.pre_loop(sleep=0)
+    # Every call is 100 seconds later, so no PLC is still backed off at the next cache update
+    mocker.patch('time.time', side_effect=itertools.count(0, 100))
+    update_cache_in_main_loop(generic_scada, mocker)
     generic_scada.main_loop(test_break=True)  # Both values are fine
-    generic_scada.main_loop(test_break=True)  # Both values throw exceptions
-    generic_scada.main_loop(test_break=True)  # Only First call throws exception
+    for _ in range(2):
+        # The cache thread is only started once, update the cache of the next iteration directly
+        for ip in generic_scada.plc_ips:
+            generic_scada.update_plc_cache(ip)
+        # Both values throw exceptions, then only the second call throws an exception
+        generic_scada.main_loop(test_break=True)
 
     # Assert saved_values has been properly modified (expect it to re-use old values)
-    assert generic_scada.saved_values == [['iteration', 'timestamp', 'T0', 'P_RAW1', 'T2', 'V_ER2i'],
-                                          [2, generic_scada.saved_values[1][1], '0.350420', '0', '0.420420', '1'],
-                                          [2, generic_scada.saved_values[2][1], '0.350420', '0', '0.420420', '1'],
-                                          [2, generic_scada.saved_values[3][1], '0.350420', '0', '100', '100']]
+    assert generic_scada.saved_values == \
+        [(2, generic_scada.saved_values[0][1], '0.420420', '1', '0.350420', '0'),
+         (2, generic_scada.saved_values[1][1], '0.420420', '1', '0.350420', '0'),
+         (2, generic_scada.saved_values[2][1], '100', '100', '0.350420', '0')]
+
+
+def test_generic_scada_write_output(generic_scada, yaml_scada_file):
+    generic_scada.pre_loop(sleep=0)
+    generic_scada.saved_values.append((1, 0, '0.1', '1', '0.2', '0'))
+    generic_scada.write_output()
+    # Assert the buffer is emptied after writing
+    assert generic_scada.saved_values == []
+
+    generic_scada.saved_values.append((2, 1.5, '0.3', '0', '0.4', '1'))
+    generic_scada.write_output()
+    generic_scada.stop_output_writer()
+    # Assert rows are appended after the header
+    with yaml_scada_file.dirpath().join("scada_values.csv").open() as output:
+        assert output.read().splitlines() == ['iteration,timestamp,T0,P_RAW1,T2,V_ER2i',
+                                              '1,{},0.1,1,0.2,0'.format(datetime.fromtimestamp(0)),
+                                              '2,{},0.3,0,0.4,1'.format(datetime.fromtimestamp(1.5))]
+
+
+def test_generic_scada_drain_output_error(generic_scada):
+    generic_scada.pre_loop(sleep=0)
+    generic_scada.output_writer = MagicMock()
+    generic_scada.output_writer.writerows.side_effect = [IOError, None]
+    generic_scada.saved_values.append((1, 0, '0.1', '1', '0.2', '0'))
+    generic_scada.write_output()
+    generic_scada.saved_values.append((2, 1.5, '0.3', '0', '0.4', '1'))
+    generic_scada.write_output()
+    generic_scada.stop_output_writer()
+    # Assert the writer thread kept draining after the failed write
+    assert generic_scada.output_writer.writerows.call_count == 2
+    assert not generic_scada.output_thread.is_alive()
+
+
+def test_generic_scada_sigint_handler(generic_scada, yaml_scada_file):
+    generic_scada.pre_loop(sleep=0)
+    generic_scada.saved_values.append((1, 0, '0.1', '1', '0.2', '0'))
+    generic_scada.sigint_handler(None, None)
+    # Assert the handler only requests the shutdown
+    assert generic_scada.stop_requested
+    assert generic_scada.saved_values == [(1, 0, '0.1', '1', '0.2', '0')]
+
+    generic_scada.main_loop()
+    # Assert main_loop wrote the remaining output before returning
+    assert generic_scada.output_file.closed
+    with yaml_scada_file.dirpath().join("scada_values.csv").open() as output:
+        assert output.read().splitlines() == ['iteration,timestamp,T0,P_RAW1,T2,V_ER2i',
+                                              '1,{},0.1,1,0.2,0'.format(datetime.fromtimestamp(0))]
+
+
+def test_generic_scada_update_plc_cache(generic_scada, magic_mock_scada_network):
+    generic_scada.update_plc_cache('192.168.1.1')
+    generic_scada.update_plc_cache('192.168.1.2')
+    # Assert each PLC got its own values
+    assert generic_scada.cache == {'192.168.1.1': ['0.420420', '1'],
+                                   '192.168.1.2': ['0.350420', '0']}
+
+    generic_scada.update_plc_cache('192.168.1.1')
+    # Assert a failed receive keeps the previous values
+    assert generic_scada.cache['192.168.1.1'] == ['0.420420', '1']
+
+
+def test_generic_scada_update_plc_cache_backoff(generic_scada, magic_mock_scada_network, mocker):
+    magic_mock_scada_network.receive_multiple.side_effect = [Exception, ['0.1', '1']]
+    mocker.patch('time.time', return_value=100)
+
+    generic_scada.update_plc_cache('192.168.1.1')
+    # Assert the PLC is not polled again before its backoff passed
+    generic_scada.update_plc_cache('192.168.1.1')
+    assert magic_mock_scada_network.receive_multiple.call_count == 1
+    assert generic_scada.receive_retry_time['192.168.1.1'] == 100 + generic_scada.SCADA_CACHE_UPDATE_TIME
+
+    mocker.patch('time.time', return_value=100 + generic_scada.SCADA_CACHE_UPDATE_TIME)
+    generic_scada.update_plc_cache('192.168.1.1')
+    assert generic_scada.cache['192.168.1.1'] == ['0.1', '1']
+    assert generic_scada.receive_failures['192.168.1.1'] == 0
+
+
+def test_generic_scada_update_plc_cache_backoff_max(generic_scada, magic_mock_scada_network, mocker):
+    magic_mock_scada_network.receive_multiple.side_effect = Exception
+    mocker.patch('time.time', return_value=100)
+
+    generic_scada.receive_failures['192.168.1.1'] = 10
+    generic_scada.update_plc_cache('192.168.1.1')
+    # Assert the backoff is capped
+    assert generic_scada.receive_failures['192.168.1.1'] == 11
+    assert generic_scada.receive_retry_time['192.168.1.1'] == 100 + GenericScada.RECEIVE_BACKOFF_MAX
+
+
+def test_generic_scada_update_cache_sleep(generic_scada, mocker):
+    generic_scada.plc_ips = ['192.168.1.1']
+    generic_scada.receive_pool = MagicMock()
+    generic_scada.update_cache_flag = True
+    # The first poll takes 0.5 seconds, the second overruns its period, the third takes 1 second
+    mocker.patch('time.time', side_effect=[0, 0.5, 7, 7, 8])
+
+    def stop_after_second_sleep(duration):
+        if sleep_mock.call_count == 2:
+            generic_scada.update_cache_flag = False
+
+    sleep_mock = mocker.patch('time.sleep', side_effect=stop_after_second_sleep)
+
+    generic_scada.update_cache(2)
+
+    # Assert a normal poll sleeps the rest of its period and an overrun poll does not sleep
+    assert sleep_mock.call_args_list == [call(1.5), call(1)]
+    assert generic_scada.receive_pool.map.call_args_list == [call(generic_scada.update_plc_cache, ['192.168.1.1'])] * 3
@@ -10,15 +10,17 @@ def patched_scada(mocker):
     sleeper = mocker.patch("time.sleep", return_value=None)
     mocker.patch.object(GenericScada, "__init__", return_value=None)
     mocker.patch.object(GenericScada, "DB_TRIES", 3)
-    mocker.patch.object(GenericScada, "DB_SLEEP_TIME", 1.5)
     cur_mock = mocker.Mock()
-    conn_mock = mocker.Mock()
+    conn_mock = mocker.MagicMock()
+    conn_mock.__enter__.return_value = conn_mock
+    conn_mock.cursor.return_value = cur_mock
+    mocker.patch("sqlite3.connect", return_value=conn_mock)
     logger_mock = mocker.Mock()
 
     scada = GenericScada()
-    scada.cur = cur_mock
-    scada.conn = conn_mock
     scada.logger = logger_mock
+    scada.db_sleep_time = 1.5
+    scada.intermediate_yaml = {'db_path': '/home/test/dhalsim.sqlite'}
 
     return scada, cur_mock, conn_mock, logger_mock, sleeper
 
@@ -33,7 +35,7 @@ def test_get_master_clock_first_try(patched_scada):
 
     cur_mock.fetchone.assert_called_once()
 
-    assert logger_mock.debug.call_count == 0
+    assert logger_mock.info.call_count == 0
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_not_called()
@@ -54,7 +56,7 @@ def test_get_master_clock_fail_once(patched_scada):
 
     cur_mock.fetchone.assert_called_once()
 
-    assert logger_mock.debug.call_count == 1
+    assert logger_mock.info.call_count == 1
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_called_once_with(1.5)
@@ -76,7 +78,7 @@ def test_get_master_clock_fail_all(patched_scada):
 
     cur_mock.fetchone.assert_not_called()
 
-    assert logger_mock.debug.call_count == 3
+    assert logger_mock.info.call_count == 3
     assert logger_mock.error.call_count == 1
 
     sleeper.assert_has_calls([call(1.5), call(1.5), call(1.5)])
@@ -87,13 +89,13 @@ def test_get_sync_first_try(patched_scada):
 
     cur_mock.fetchone.return_value = [1]
 
-    assert scada.get_sync() is True
+    assert scada.get_sync(1) is True
 
-    cur_mock.execute.assert_called_once_with("SELECT flag FROM sync WHERE name IS 'scada'")
+    cur_mock.execute.assert_called_once_with("SELECT flag FROM sync WHERE name IS ?", ('scada',))
 
     cur_mock.fetchone.assert_called_once()
 
-    assert logger_mock.debug.call_count == 0
+    assert logger_mock.info.call_count == 0
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_not_called()
@@ -106,15 +108,15 @@ def test_get_sync_fail_once(patched_scada):
 
     cur_mock.fetchone.return_value = [1]
 
-    assert scada.get_sync() is True
+    assert scada.get_sync(1) is True
 
-    cur_mock.execute.assert_has_calls([call("SELECT flag FROM sync WHERE name IS 'scada'"),
-                                       call("SELECT flag FROM sync WHERE name IS 'scada'")])
+    cur_mock.execute.assert_has_calls([call("SELECT flag FROM sync WHERE name IS ?", ('scada',)),
+                                       call("SELECT flag FROM sync WHERE name IS ?", ('scada',))])
     assert cur_mock.execute.call_count == 2
 
     cur_mock.fetchone.assert_called_once()
 
-    assert logger_mock.debug.call_count == 1
+    assert logger_mock.info.call_count == 1
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_called_once_with(1.5)
@@ -127,16 +129,16 @@ def test_get_sync_fail_all(patched_scada):
                                     sqlite3.OperationalError(), None]
 
     with pytest.raises(DatabaseError):
-        scada.get_sync()
+        scada.get_sync(1)
 
-    cur_mock.execute.assert_has_calls([call("SELECT flag FROM sync WHERE name IS 'scada'"),
-                                       call("SELECT flag FROM sync WHERE name IS 'scada'"),
-                                       call("SELECT flag FROM sync WHERE name IS 'scada'")])
+    cur_mock.execute.assert_has_calls([call("SELECT flag FROM sync WHERE name IS ?", ('scada',)),
+                                       call("SELECT flag FROM sync WHERE name IS ?", ('scada',)),
+                                       call("SELECT flag FROM sync WHERE name IS ?", ('scada',))])
     assert cur_mock.execute.call_count == 3
 
     cur_mock.fetchone.assert_not_called()
 
-    assert logger_mock.debug.call_count == 3
+    assert logger_mock.info.call_count == 3
     assert logger_mock.error.call_count == 1
 
     sleeper.assert_has_calls([call(1.5), call(1.5), call(1.5)])
@@ -148,11 +150,11 @@ def test_set_sync_first_try(patched_scada):
 
     scada.set_sync(True)
 
-    cur_mock.execute.assert_called_once_with("UPDATE sync SET flag=? WHERE name IS 'scada'", (1,))
+    cur_mock.execute.assert_called_once_with("UPDATE sync SET flag=? WHERE name IS ?", (1, 'scada',))
 
     conn_mock.commit.assert_called_once()
 
-    assert logger_mock.debug.call_count == 0
+    assert logger_mock.info.call_count == 0
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_not_called()
@@ -165,13 +167,13 @@ def test_set_sync_fail_once(patched_scada):
 
     scada.set_sync(True)
 
-    cur_mock.execute.assert_has_calls([call("UPDATE sync SET flag=? WHERE name IS 'scada'", (1,)),
-                                       call("UPDATE sync SET flag=? WHERE name IS 'scada'", (1,))])
+    cur_mock.execute.assert_has_calls([call("UPDATE sync SET flag=? WHERE name IS ?", (1, 'scada',)),
+                                       call("UPDATE sync SET flag=? WHERE name IS ?", (1, 'scada',))])
     assert cur_mock.execute.call_count == 2
 
     conn_mock.commit.assert_called_once()
 
-    assert logger_mock.debug.call_count == 1
+    assert logger_mock.info.call_count == 1
     assert logger_mock.error.call_count == 0
 
     sleeper.assert_called_once_with(1.5)
@@ -186,14 +188,14 @@ def test_set_sync_fail_all(patched_scada):
     with pytest.raises(DatabaseError):
         scada.set_sync(True)
 
-    cur_mock.execute.assert_has_calls([call("UPDATE sync SET flag=? WHERE name IS 'scada'", (1,)),
-                                       call("UPDATE sync SET flag=? WHERE name IS 'scada'", (1,)),
-                                       call("UPDATE sync SET flag=? WHERE name IS 'scada'", (1,))])
+    cur_mock.execute.assert_has_calls([call("UPDATE sync SET flag=? WHERE name IS ?", (1, 'scada',)),
+                                       call("UPDATE sync SET flag=? WHERE name IS ?", (1, 'scada',)),
+                                       call("UPDATE sync SET flag=? WHERE name IS ?", (1, 'scada',))])
     assert cur_mock.execute.call_count == 3
 
     conn_mock.commit.assert_not_called()
 
-    assert logger_mock.debug.call_count == 3
+    assert logger_mock.info.call_count == 3
     assert logger_mock.error.call_count == 1
 
     sleeper.assert_has_calls([call(1.5), call(1.5), call(1.5)])
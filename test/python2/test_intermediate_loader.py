@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+import yaml
+from pathlib import Path
+
+from dhalsim.python2.intermediate_loader import dump_intermediate_pickle, load_intermediate_yaml, pickle_path
+
+
+@pytest.fixture
+def intermediate_yaml_path(tmpdir):
+    intermediate = tmpdir.join("intermediate.yaml")
+    with intermediate.open(mode='w') as intermediate_yaml:
+        yaml.safe_dump({"log_level": "info", "plcs": [{"name": "PLC1", "sensors": ["T0"]}]}, intermediate_yaml)
+    return Path(str(intermediate))
+
+
+def test_python_version():
+    assert sys.version_info.major is 2
+    assert sys.version_info.minor is 7
+
+
+def test_load_without_pickle(intermediate_yaml_path):
+    assert load_intermediate_yaml(intermediate_yaml_path) == \
+           {"log_level": "info", "plcs": [{"name": "PLC1", "sensors": ["T0"]}]}
+
+
+def test_load_from_pickle(intermediate_yaml_path):
+    dump_intermediate_pickle({"log_level": "debug"}, intermediate_yaml_path)
+
+    assert pickle_path(intermediate_yaml_path) == intermediate_yaml_path.parent / "intermediate.pickle"
+    assert load_intermediate_yaml(intermediate_yaml_path) == {"log_level": "debug"}
+
+
+def test_load_ignores_outdated_pickle(intermediate_yaml_path):
+    dump_intermediate_pickle({"log_level": "debug"}, intermediate_yaml_path)
+    # Make the yaml more recent than its pickled copy
+    yaml_mtime = intermediate_yaml_path.stat().st_mtime
+    os.utime(str(intermediate_yaml_path), (yaml_mtime + 10, yaml_mtime + 10))
+
+    assert load_intermediate_yaml(intermediate_yaml_path)["log_level"] == "info"
+
+
+def test_load_ignores_pickle_with_equal_mtime(intermediate_yaml_path):
+    dump_intermediate_pickle({"log_level": "debug"}, intermediate_yaml_path)
+    # Rewrite the yaml within the same modification time as its pickled copy
+    pickle_mtime = pickle_path(intermediate_yaml_path).stat().st_mtime
+    with intermediate_yaml_path.open(mode='w') as intermediate_yaml:
+        yaml.safe_dump({"log_level": "error"}, intermediate_yaml)
+    os.utime(str(intermediate_yaml_path), (pickle_mtime, pickle_mtime))
+
+    assert load_intermediate_yaml(intermediate_yaml_path) == {"log_level": "error"}